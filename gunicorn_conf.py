@@ -0,0 +1,15 @@
+# Gunicorn settings for production:  gunicorn -c gunicorn_conf.py server:app
+#
+# Handlers mostly wait on SQLite and Redis, so gthread workers give real
+# concurrency. Each worker keeps a connection pool sized to its thread count.
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 3000)}"
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+keepalive = 5
+preload_app = True
+
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
@@ -1,16 +1,43 @@
 import os
-import uuid
+import time
+import gzip
+import hmac
+import hashlib
+import mimetypes
+import secrets
+import tempfile
+import queue
+import threading
+from concurrent.futures import Future
 import sqlite3
-from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory, session, redirect, url_for
+from flask import Flask, Response, g, request, jsonify, send_from_directory, session, redirect, url_for
 from flask_cors import CORS
-from urllib.request import Request, urlopen
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import safe_join
 import json
+import urllib3
+from urllib.parse import quote
 try:
     from dotenv import load_dotenv
     load_dotenv()
 except Exception:
     pass
+try:
+    import redis
+except Exception:
+    redis = None
+try:
+    import orjson
+except Exception:
+    orjson = None
+try:
+    from flask_session import Session
+except Exception:
+    Session = None
+try:
+    import bcrypt
+except Exception:
+    bcrypt = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'data.db')
@@ -19,6 +46,14 @@ UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads')
 app = Flask(__name__, static_url_path='', static_folder=BASE_DIR)
 CORS(app, supports_credentials=True)
 
+# Number of reverse proxies (e.g. nginx) in front of the app whose
+# X-Forwarded-* headers are trusted, so request.remote_addr is the client
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS, x_host=TRUSTED_PROXY_HOPS
+    )
+
 # Session / Auth config
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'change-this-in-production')
 app.config.update(
@@ -26,8 +61,230 @@ app.config.update(
     SESSION_COOKIE_HTTPONLY=True,
 )
 
+# Offload upload transfers to the front proxy (see nginx.conf.example):
+#   'x-accel'    -> nginx X-Accel-Redirect to ACCEL_REDIRECT_PREFIX
+#   'x-sendfile' -> Apache/lighttpd X-Sendfile via Flask's built-in support
+SENDFILE_MODE = (os.environ.get('SENDFILE_MODE') or '').lower()
+ACCEL_REDIRECT_PREFIX = os.environ.get('ACCEL_REDIRECT_PREFIX', '/_protected/uploads/')
+# Upload names are never reused for different bytes, so clients may cache forever
+UPLOAD_MAX_AGE = 31536000
+app.use_x_sendfile = SENDFILE_MODE == 'x-sendfile'
+
 ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL')
+# Admin credentials are read once. Prefer ADMIN_PASS_BCRYPT (a bcrypt hash);
+# the plaintext ADMIN_PASS is still honoured when no hash is configured.
+ADMIN_USER = os.environ.get('ADMIN_USER', 'admin')
+ADMIN_PASS = os.environ.get('ADMIN_PASS', 'admin123')
+ADMIN_PASS_BCRYPT = (os.environ.get('ADMIN_PASS_BCRYPT') or '').encode('utf-8')
+LOGIN_MAX_ATTEMPTS = int(os.environ.get('LOGIN_MAX_ATTEMPTS', 10))
+LOGIN_WINDOW = 60
 DISCORD_WEBHOOK_URL = os.environ.get('DISCORD_WEBHOOK_URL')
+REDIS_URL = os.environ.get('REDIS_URL')
+
+# Server-side sessions: the cookie only carries a random session id and logout
+# deletes the Redis key. Falls back to Flask's signed-cookie sessions.
+if Session is not None and redis is not None and REDIS_URL:
+    app.config.update(
+        SESSION_TYPE='redis',
+        SESSION_REDIS=redis.from_url(REDIS_URL),
+        SESSION_PERMANENT=False,
+    )
+    Session(app)
+PRODUCTS_CACHE_TTL = int(os.environ.get('PRODUCTS_CACHE_TTL', 300))
+
+# Optional Redis cache; every helper degrades to a no-op when unavailable
+_redis = None
+if redis is not None and REDIS_URL:
+    try:
+        _redis = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    except Exception:
+        _redis = None
+
+
+def cache_get(key):
+    if _redis is None:
+        return None
+    try:
+        return _redis.get(key)
+    except Exception:
+        return None
+
+
+def cache_set(key, value, ex=PRODUCTS_CACHE_TTL):
+    if _redis is None:
+        return
+    try:
+        _redis.set(key, value, ex=ex)
+    except Exception:
+        pass
+
+
+def cache_version(key):
+    # Per-table version for conditional GETs. A missing key is seeded from the
+    # clock so a Redis flush can never resurrect an ETag a client still holds.
+    if _redis is None:
+        return None
+    try:
+        ver = _redis.get(key)
+        if ver is None:
+            _redis.set(key, time.time_ns(), nx=True)
+            ver = _redis.get(key)
+        return ver
+    except Exception:
+        return None
+
+
+def cache_bump(key):
+    if _redis is None:
+        return
+    try:
+        _redis.incr(key)
+    except Exception:
+        pass
+
+
+def not_modified(etag):
+    resp = Response(status=304)
+    resp.set_etag(etag, weak=True)
+    return resp
+
+
+def with_etag(resp, etag):
+    if etag:
+        resp.set_etag(etag, weak=True)
+        resp.headers['Cache-Control'] = 'private, must-revalidate'
+    return resp
+
+
+def rate_limited(key, limit, window):
+    # Fixed-window counter; never limits when Redis is unavailable
+    if _redis is None:
+        return False
+    try:
+        # Create the key with its TTL and increment it in one MULTI/EXEC so a
+        # counter can never be left behind without an expiry
+        pipe = _redis.pipeline()
+        pipe.set(key, 0, ex=window, nx=True)
+        pipe.incr(key)
+        _, count = pipe.execute()
+        return count > limit
+    except Exception:
+        return False
+
+
+def json_dumps(obj):
+    # orjson is much faster on large row lists; fall back to the stdlib
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj)
+
+
+def json_response(body, status=200):
+    return Response(body, status=status, mimetype='application/json')
+
+
+# Request values are bounded before they reach SQLite, which cannot bind
+# integers outside the signed 64-bit range
+SQLITE_MAX_INT = 2 ** 63 - 1
+MAX_ITEM_QUANTITY = 999
+
+
+def parse_id(value):
+    """Return value as a positive row id, or None if it is not one."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float):
+        if not value.is_integer():
+            return None
+    elif not isinstance(value, (int, str)):
+        return None
+    try:
+        value = int(value)
+    except (ValueError, OverflowError):
+        return None
+    return value if 0 < value <= SQLITE_MAX_INT else None
+
+
+def parse_quantity(value):
+    """Coerce a quantity to 1..MAX_ITEM_QUANTITY, falling back to 1."""
+    if isinstance(value, bool):
+        return 1
+    try:
+        qty = int(value or 1)
+    except (TypeError, ValueError, OverflowError):
+        return 1
+    return min(max(qty, 1), MAX_ITEM_QUANTITY)
+
+
+PRODUCT_COLUMNS = ('id', 'name', 'price', 'image', 'model_image', 'desc', 'color', 'sizes', 'season', 'type', 'status')
+ORDER_COLUMNS = (
+    'id', 'product', 'color', 'size', 'amount', 'name', 'phone', 'gov', 'city',
+    'address', 'price', 'shipping', 'total', 'addition', 'date',
+)
+CART_COLUMNS = ('id', 'product_id', 'size', 'color', 'quantity', 'name', 'price', 'image')
+
+SELECT_PRODUCTS_SQL = (
+    'SELECT id, name, price, image, model_image, "desc", color, sizes, season, type, status FROM products'
+)
+SELECT_ORDERS_SQL = (
+    'SELECT id, product, color, size, amount, name, phone, gov, city, address, price, shipping, total, addition, date '
+    'FROM customers ORDER BY id DESC'
+)
+
+# Every statement the handlers run is a module constant, so each one is a
+# single entry in sqlite3's per-connection statement cache.
+SELECT_PRODUCT_SQL = SELECT_PRODUCTS_SQL + ' WHERE id = ?'
+INSERT_PRODUCT_SQL = (
+    'INSERT INTO products (name, price, image, model_image, "desc", color, sizes, season, type, status) '
+    'VALUES (?,?,?,?,?,?,?,?,?,?)'
+)
+DELETE_PRODUCT_SQL = 'DELETE FROM products WHERE id = ?'
+
+# The primary image (first of a comma-separated list) is picked in SQL
+SELECT_CART_SQL = '''
+    SELECT ci.id, ci.product_id, ci.size, ci.color, ci.quantity, p.name, p.price,
+           trim(CASE WHEN instr(p.image, ',') > 0
+                     THEN substr(p.image, 1, instr(p.image, ',') - 1)
+                     ELSE IFNULL(p.image, '') END) AS image
+    FROM cart_items ci
+    JOIN products p ON p.id = ci.product_id
+    WHERE ci.cart_id = ?
+    ORDER BY ci.id DESC
+'''
+# Quantity clamping and price defaults are done here so checkout makes a
+# single Python pass over the rows
+SELECT_CHECKOUT_ITEMS_SQL = '''
+    SELECT ci.size, ci.color, MAX(IFNULL(ci.quantity, 1), 1) AS quantity,
+           p.name AS product_name, IFNULL(p.price, 0) AS product_price
+    FROM cart_items ci
+    JOIN products p ON p.id = ci.product_id
+    WHERE ci.cart_id = ?
+    ORDER BY ci.id ASC
+'''
+# Adding an existing variant again bumps its quantity
+INSERT_CART_SQL = f'''
+    INSERT INTO cart_items (cart_id, product_id, size, color, quantity) VALUES (?,?,?,?,?)
+    ON CONFLICT(cart_id, product_id, size, color)
+    DO UPDATE SET quantity = MIN(quantity + excluded.quantity, {MAX_ITEM_QUANTITY})
+    RETURNING id
+'''
+UPDATE_CART_SQL = 'UPDATE cart_items SET quantity = ? WHERE id = ? AND cart_id = ?'
+DELETE_CART_ITEM_SQL = 'DELETE FROM cart_items WHERE id = ? AND cart_id = ?'
+DELETE_CART_SQL = 'DELETE FROM cart_items WHERE cart_id = ?'
+
+INSERT_CUSTOMER_SQL = '''
+    INSERT INTO customers (product, color, size, amount, name, phone, gov, city, address, price, shipping, total, addition, date)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,COALESCE(?, datetime('now', 'localtime')))
+'''
+DELETE_CUSTOMER_SQL = 'DELETE FROM customers WHERE id = ?'
+
+
+# Shared keep-alive pool so webhook posts reuse one TLS connection
+_http = urllib3.PoolManager(
+    num_pools=1,
+    maxsize=4,
+    retries=urllib3.Retry(total=2, backoff_factor=0.2),
+)
 
 
 def send_discord(content):
@@ -37,10 +294,11 @@ def send_discord(content):
             return False
         data = json.dumps({"content": content}).encode('utf-8')
         headers = {"Content-Type": "application/json"}
-        req = Request(url, data=data, headers=headers)
-        with urlopen(req, timeout=10) as resp:
-            _ = resp.read()
-        return True
+        resp = _http.request(
+            'POST', url, body=data, headers=headers,
+            timeout=urllib3.Timeout(connect=2, read=5),
+        )
+        return 200 <= resp.status < 300
     except Exception:
         try:
             print("[discord] send failed", flush=True)
@@ -48,19 +306,173 @@ def send_discord(content):
             pass
         return False
 
+
+# Webhook posts run on a daemon thread so request handlers never block on
+# Discord. Messages arriving within DISCORD_BATCH_WINDOW are joined into one
+# post, capped at Discord's 2000 character content limit.
+DISCORD_BATCH_WINDOW = 0.2
+DISCORD_MAX_CONTENT = 2000
+discord_queue = queue.Queue(maxsize=1000)
+_discord_worker = None
+_discord_worker_lock = threading.Lock()
+
+
+def _drain_discord_queue():
+    while True:
+        batch = [discord_queue.get()]
+        size = len(batch[0])
+        deadline = time.monotonic() + DISCORD_BATCH_WINDOW
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                msg = discord_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + 1 + len(msg) > DISCORD_MAX_CONTENT:
+                send_discord("\n".join(batch))
+                batch, size = [], -1
+            batch.append(msg)
+            size += 1 + len(msg)
+        send_discord("\n".join(batch))
+
+
+def notify_discord(content):
+    global _discord_worker
+    if not DISCORD_WEBHOOK_URL:
+        return
+    # Started lazily so each forked worker process gets its own thread
+    if _discord_worker is None or not _discord_worker.is_alive():
+        with _discord_worker_lock:
+            if _discord_worker is None or not _discord_worker.is_alive():
+                _discord_worker = threading.Thread(
+                    target=_drain_discord_queue, name='discord-notify', daemon=True
+                )
+                _discord_worker.start()
+    try:
+        discord_queue.put_nowait(content)
+    except queue.Full:
+        print("[discord] queue full, dropping message", flush=True)
+
 # --- Database helpers ---
 
+# Connections are recycled through a small LIFO pool (sized to the number of
+# worker threads) instead of sharing a single connection across requests.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+_db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+DB_PRAGMAS = (
+    'PRAGMA journal_mode=WAL;'
+    'PRAGMA synchronous=NORMAL;'
+    'PRAGMA temp_store=MEMORY;'
+    'PRAGMA mmap_size=268435456;'
+    'PRAGMA cache_size=-20000;'
+)
+
+
+def _connect_db():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(DB_PRAGMAS)
+    return conn
+
+
 def get_db():
-    conn = getattr(app, '_db_conn', None)
+    conn = g.get('db')
     if conn is None:
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        app._db_conn = conn
+        try:
+            conn = _db_pool.get_nowait()
+        except queue.Empty:
+            conn = _connect_db()
+        g.db = conn
     return conn
 
 
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    try:
+        # Never hand an open transaction to the next request
+        conn.rollback()
+        _db_pool.put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.close()
+
+
+# Cart mutations are cheap and frequent, so they are group-committed: a
+# writer thread runs every statement already queued in one transaction and
+# resolves each caller's Future only after the commit. Batching is greedy, so
+# a lone write commits at once and writes that arrive while a commit is in
+# flight share the next one (at most CART_MAX_BATCH statements). Each
+# statement runs under a savepoint so one failure does not undo the others.
+CART_MAX_BATCH = 256
+CART_WRITE_TIMEOUT = 10
+_cart_writes = queue.Queue()
+_cart_writer = None
+_cart_writer_lock = threading.Lock()
+
+
+def _run_cart_writer():
+    conn = _connect_db()
+    while True:
+        batch = [_cart_writes.get()]
+        while len(batch) < CART_MAX_BATCH:
+            try:
+                batch.append(_cart_writes.get_nowait())
+            except queue.Empty:
+                break
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for sql, params, fut in batch:
+                conn.execute('SAVEPOINT cart_write')
+                try:
+                    cur = conn.execute(sql, params)
+                    rows = cur.fetchall()
+                    rowcount = cur.rowcount
+                    conn.execute('RELEASE cart_write')
+                    results.append((fut, (rowcount, rows[0] if rows else None), None))
+                except Exception as e:
+                    # Any per-statement failure (including bind errors such as
+                    # OverflowError) fails only that caller, not the batch
+                    conn.execute('ROLLBACK TO cart_write')
+                    conn.execute('RELEASE cart_write')
+                    results.append((fut, None, e))
+            conn.commit()
+        except Exception as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            results = [(fut, None, e) for _, _, fut in batch]
+        for fut, result, err in results:
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(result)
+
+
+def cart_write(sql, params):
+    """Run a cart write through the group-commit thread; returns (rowcount, first row)."""
+    global _cart_writer
+    # Started lazily so each forked worker process gets its own thread
+    if _cart_writer is None or not _cart_writer.is_alive():
+        with _cart_writer_lock:
+            if _cart_writer is None or not _cart_writer.is_alive():
+                _cart_writer = threading.Thread(target=_run_cart_writer, name='cart-writer', daemon=True)
+                _cart_writer.start()
+    fut = Future()
+    _cart_writes.put((sql, params, fut))
+    return fut.result(timeout=CART_WRITE_TIMEOUT)
+
+
 def init_db():
-    conn = get_db()
+    # Uses its own connection so nothing opened at import time is pooled and
+    # later inherited by forked (preload_app) gunicorn workers
+    conn = _connect_db()
     cur = conn.cursor()
     cur.execute(
         """
@@ -110,7 +522,7 @@ def init_db():
             shipping REAL,
             total REAL,
             addition TEXT,
-            date TEXT
+            date TEXT DEFAULT (datetime('now', 'localtime'))
         )
         """
     )
@@ -127,7 +539,38 @@ def init_db():
         cur.execute('ALTER TABLE products ADD COLUMN model_image TEXT')
     except Exception:
         pass
+    # Cart lookups filter by cart_id and order by id; products are joined by id
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_cart_items_cart_id_id ON cart_items(cart_id, id DESC)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_cart_items_product_id ON cart_items(product_id)')
+    # One row per cart variant; merge duplicates left by older versions first
+    has_variant_index = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ux_cart_variant'"
+    ).fetchone()
+    if not has_variant_index:
+        cur.execute("UPDATE cart_items SET size = IFNULL(size, ''), color = IFNULL(color, '')")
+        cur.execute(
+            '''
+            UPDATE cart_items SET quantity = (
+                SELECT SUM(c2.quantity) FROM cart_items c2
+                WHERE c2.cart_id = cart_items.cart_id AND c2.product_id = cart_items.product_id
+                  AND c2.size = cart_items.size AND c2.color = cart_items.color
+            )
+            WHERE id IN (
+                SELECT MIN(id) FROM cart_items
+                GROUP BY cart_id, product_id, size, color HAVING COUNT(*) > 1
+            )
+            '''
+        )
+        cur.execute(
+            '''
+            DELETE FROM cart_items WHERE id NOT IN (
+                SELECT MIN(id) FROM cart_items GROUP BY cart_id, product_id, size, color
+            )
+            '''
+        )
+        cur.execute('CREATE UNIQUE INDEX ux_cart_variant ON cart_items(cart_id, product_id, size, color)')
     conn.commit()
+    conn.close()
 
 
 # Initialize DB on startup
@@ -143,10 +586,14 @@ except Exception:
 # --- Cookie management (ensure cart_id) ---
 @app.after_request
 def ensure_cart_cookie(response):
-    if 'cart_id' not in request.cookies:
-        response.set_cookie(
-            'cart_id', str(uuid.uuid4()), httponly=False, samesite='Lax'
-        )
+    if 'cart_id' in request.cookies:
+        return response
+    # Only pages and API calls need a cart; skip uploads, CSS, JS, images
+    if request.path.startswith('/uploads/') or response.mimetype not in ('text/html', 'application/json'):
+        return response
+    response.set_cookie(
+        'cart_id', secrets.token_urlsafe(16), httponly=False, samesite='Lax'
+    )
     return response
 
 
@@ -159,12 +606,50 @@ def api_me():
 
 
 # --- Static files (serve current directory) ---
+# Routed HTML pages are read, stat'ed and gzipped once at startup; requests
+# are answered from memory and revalidated with ETag/Last-Modified.
+HTML_PAGES = ('index.html', 'admin.html', 'customers.html', 'login.html')
+
+
+def _load_html(name):
+    path = os.path.join(BASE_DIR, name)
+    try:
+        st = os.stat(path)
+        with open(path, 'rb') as fh:
+            body = fh.read()
+    except OSError:
+        return None
+    etag = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+    return body, gzip.compress(body, 9), etag, st.st_mtime
+
+
+_html_cache = {name: _load_html(name) for name in HTML_PAGES}
+
+
+def serve_html(name):
+    entry = _load_html(name) if app.debug else _html_cache.get(name)
+    if entry is None:
+        return jsonify({"error": "Not found"}), 404
+    body, body_gz, etag, mtime = entry
+    resp = Response(mimetype='text/html')
+    resp.vary.add('Accept-Encoding')
+    if request.accept_encodings['gzip']:
+        resp.set_data(body_gz)
+        resp.headers['Content-Encoding'] = 'gzip'
+        resp.set_etag(etag + '-gz')
+    else:
+        resp.set_data(body)
+        resp.set_etag(etag)
+    resp.last_modified = mtime
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp.make_conditional(request)
+
+
 @app.route('/')
 def root():
     # Serve index.html if present, otherwise list static root
-    index_path = os.path.join(BASE_DIR, 'index.html')
-    if os.path.exists(index_path):
-        return send_from_directory(BASE_DIR, 'index.html')
+    if _html_cache.get('index.html') is not None:
+        return serve_html('index.html')
     return jsonify({"ok": True, "message": "API server running"})
 
 @app.get('/api/test/discord')
@@ -183,9 +668,27 @@ def upload_files():
                 fn = f.filename or ''
                 if '.' in fn:
                     ext = '.' + fn.rsplit('.', 1)[-1].lower()
-                new_name = f"{uuid.uuid4().hex}{ext}"
+                # Content-addressed name: identical re-uploads map to one file
+                digest = hashlib.sha256()
+                for chunk in iter(lambda: f.stream.read(65536), b''):
+                    digest.update(chunk)
+                new_name = f"{digest.hexdigest()[:32]}{ext}"
                 target_path = os.path.join(UPLOAD_DIR, new_name)
-                f.save(target_path)
+                if not os.path.exists(target_path):
+                    # Write to a temp file and rename so the hashed name only
+                    # ever points at a complete file, even under concurrent
+                    # uploads of the same bytes or a failed write
+                    f.stream.seek(0)
+                    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, prefix='.upload-')
+                    try:
+                        with os.fdopen(fd, 'wb') as out:
+                            f.save(out)
+                        # mkstemp creates 0600; the proxy must be able to read it
+                        os.chmod(tmp_path, 0o644)
+                        os.replace(tmp_path, target_path)
+                    except Exception:
+                        os.unlink(tmp_path)
+                        raise
                 saved_urls.append(f"/uploads/{new_name}")
             except Exception:
                 continue
@@ -197,7 +700,18 @@ def upload_files():
 @app.get('/uploads/<path:filename>')
 def serve_upload(filename):
     try:
-        return send_from_directory(UPLOAD_DIR, filename)
+        if SENDFILE_MODE == 'x-accel':
+            path = safe_join(UPLOAD_DIR, filename)
+            if path is None or not os.path.isfile(path):
+                return jsonify({"error": "Not found"}), 404
+            resp = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            # Escape ?, %, spaces etc. so nginx treats the name as a path
+            resp.headers['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX + quote(filename)
+        else:
+            etag = os.path.splitext(os.path.basename(filename))[0]
+            resp = send_from_directory(UPLOAD_DIR, filename, etag=etag, max_age=UPLOAD_MAX_AGE)
+        resp.headers['Cache-Control'] = f'public, max-age={UPLOAD_MAX_AGE}, immutable'
+        return resp
     except Exception as e:
         return jsonify({"error": str(e)}), 404
 
@@ -210,20 +724,34 @@ def _require_admin():
 def serve_admin():
     if not _require_admin():
         return redirect(url_for('serve_login'))
-    return send_from_directory(BASE_DIR, 'admin.html')
+    return serve_html('admin.html')
 
 
 @app.get('/customers.html')
 def serve_customers():
     if not _require_admin():
         return redirect(url_for('serve_login'))
-    return send_from_directory(BASE_DIR, 'customers.html')
+    return serve_html('customers.html')
 
 
 # --- Simple username/password auth (no Google) ---
 @app.get('/login')
 def serve_login():
-    return send_from_directory(BASE_DIR, 'login.html')
+    return serve_html('login.html')
+
+
+def _check_admin(username, password):
+    user_ok = hmac.compare_digest(username.encode('utf-8'), ADMIN_USER.encode('utf-8'))
+    if ADMIN_PASS_BCRYPT:
+        if bcrypt is None:
+            return False
+        try:
+            pass_ok = bcrypt.checkpw(password.encode('utf-8'), ADMIN_PASS_BCRYPT)
+        except ValueError:
+            pass_ok = False
+    else:
+        pass_ok = hmac.compare_digest(password.encode('utf-8'), ADMIN_PASS.encode('utf-8'))
+    return user_ok and pass_ok
 
 
 @app.post('/login')
@@ -234,10 +762,10 @@ def do_login():
     username = data.get('username') or ''
     password = data.get('password') or ''
 
-    admin_user = os.environ.get('ADMIN_USER', 'admin')
-    admin_pass = os.environ.get('ADMIN_PASS', 'admin123')
+    if rate_limited(f"login:{request.remote_addr}", LOGIN_MAX_ATTEMPTS, LOGIN_WINDOW):
+        return jsonify({"error": "Too many attempts, try again later"}), 429
 
-    if username == admin_user and password == admin_pass:
+    if isinstance(username, str) and isinstance(password, str) and _check_admin(username, password):
         session.clear()
         session['admin'] = True
         session['user'] = {'email': ADMIN_EMAIL or '', 'name': 'Admin'}
@@ -255,8 +783,22 @@ def logout():
 @app.get('/api/products')
 def list_products():
     try:
-        rows = get_db().execute('SELECT * FROM products').fetchall()
-        return jsonify([dict(r) for r in rows])
+        ver = cache_version('products:ver')
+        etag = f"prod-{ver}" if ver else None
+        if etag and request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        # The body is keyed by the version its ETag names, so a body built
+        # from rows read before a write can never be served under a newer ETag.
+        # Without a version (Redis unavailable) nothing is cached.
+        key = f"products:all:{ver}" if ver else None
+        cached = cache_get(key) if key else None
+        if cached is not None:
+            return with_etag(json_response(cached), etag)
+        rows = get_db().execute(SELECT_PRODUCTS_SQL).fetchall()
+        body = json_dumps([dict(zip(PRODUCT_COLUMNS, r)) for r in rows])
+        if key:
+            cache_set(key, body)
+        return with_etag(json_response(body), etag)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -264,10 +806,20 @@ def list_products():
 @app.get('/api/products/<int:pid>')
 def get_product(pid):
     try:
-        row = get_db().execute('SELECT * FROM products WHERE id = ?', (pid,)).fetchone()
+        # Versioned like the list so a row read before a write is never
+        # cached under the version that follows it
+        ver = cache_version('products:ver')
+        key = f"products:{pid}:{ver}" if ver else None
+        cached = cache_get(key) if key else None
+        if cached is not None:
+            return json_response(cached)
+        row = get_db().execute(SELECT_PRODUCT_SQL, (pid,)).fetchone()
         if not row:
             return jsonify({"error": "Not found"}), 404
-        return jsonify(dict(row))
+        body = json_dumps(dict(zip(PRODUCT_COLUMNS, row)))
+        if key:
+            cache_set(key, body)
+        return json_response(body)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -292,10 +844,11 @@ def create_product():
     try:
         cur = get_db().cursor()
         cur.execute(
-            'INSERT INTO products (name, price, image, model_image, desc, color, sizes, season, type, status) VALUES (?,?,?,?,?,?,?,?,?,?)',
+            INSERT_PRODUCT_SQL,
             (name, price, image, model_image, desc, color, sizes, season, ptype, status)
         )
         get_db().commit()
+        cache_bump('products:ver')
         return jsonify({"id": cur.lastrowid}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -305,8 +858,9 @@ def create_product():
 def delete_product(pid):
     try:
         cur = get_db().cursor()
-        cur.execute('DELETE FROM products WHERE id = ?', (pid,))
+        cur.execute(DELETE_PRODUCT_SQL, (pid,))
         get_db().commit()
+        cache_bump('products:ver')
         if cur.rowcount == 0:
             return jsonify({"error": "Not found"}), 404
         return jsonify({"ok": True})
@@ -319,31 +873,8 @@ def delete_product(pid):
 def get_cart():
     try:
         cart_id = request.cookies.get('cart_id')
-        rows = get_db().execute(
-            '''
-            SELECT cart_items.*, products.name, products.price, products.image
-            FROM cart_items
-            JOIN products ON products.id = cart_items.product_id
-            WHERE cart_items.cart_id = ?
-            ORDER BY cart_items.id DESC
-            ''',
-            (cart_id,)
-        ).fetchall()
-        # Normalize image to primary image (first URL) if multiple are comma-separated
-        normalized = []
-        for r in rows:
-            d = dict(r)
-            img = d.get('image') or ''
-            try:
-                if isinstance(img, str):
-                    if ',' in img:
-                        d['image'] = img.split(',')[0].strip()
-                    else:
-                        d['image'] = img.strip()
-            except Exception:
-                pass
-            normalized.append(d)
-        return jsonify(normalized)
+        rows = get_db().execute(SELECT_CART_SQL, (cart_id,)).fetchall()
+        return json_response(json_dumps([dict(zip(CART_COLUMNS, r)) for r in rows]))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -359,22 +890,15 @@ def add_to_cart():
 
     if not product_id:
         return jsonify({"error": "product_id required"}), 400
+    product_id = parse_id(product_id)
+    if product_id is None:
+        return jsonify({"error": "product_id must be integer"}), 400
 
-    try:
-        qty = int(quantity) if isinstance(quantity, (int, float, str)) and str(quantity).isdigit() else 1
-        if qty <= 0:
-            qty = 1
-    except Exception:
-        qty = 1
+    qty = parse_quantity(quantity)
 
     try:
-        cur = get_db().cursor()
-        cur.execute(
-            'INSERT INTO cart_items (cart_id, product_id, size, color, quantity) VALUES (?,?,?,?,?)',
-            (cart_id, product_id, size, color, qty)
-        )
-        get_db().commit()
-        return jsonify({"id": cur.lastrowid}), 201
+        _, row = cart_write(INSERT_CART_SQL, (cart_id, product_id, size, color, qty))
+        return jsonify({"id": row[0]}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -383,10 +907,8 @@ def add_to_cart():
 def delete_cart_item(item_id):
     try:
         cart_id = request.cookies.get('cart_id')
-        cur = get_db().cursor()
-        cur.execute('DELETE FROM cart_items WHERE id = ? AND cart_id = ?', (item_id, cart_id))
-        get_db().commit()
-        if cur.rowcount == 0:
+        rowcount, _ = cart_write(DELETE_CART_ITEM_SQL, (item_id, cart_id))
+        if rowcount == 0:
             return jsonify({"error": "Not found"}), 404
         return jsonify({"ok": True})
     except Exception as e:
@@ -406,13 +928,11 @@ def update_cart_item(item_id):
         except Exception:
             return jsonify({"error": "quantity must be integer"}), 400
 
-        cur = get_db().cursor()
         if qty <= 0:
-            cur.execute('DELETE FROM cart_items WHERE id = ? AND cart_id = ?', (item_id, cart_id))
+            rowcount, _ = cart_write(DELETE_CART_ITEM_SQL, (item_id, cart_id))
         else:
-            cur.execute('UPDATE cart_items SET quantity = ? WHERE id = ? AND cart_id = ?', (qty, item_id, cart_id))
-        get_db().commit()
-        if cur.rowcount == 0:
+            rowcount, _ = cart_write(UPDATE_CART_SQL, (min(qty, MAX_ITEM_QUANTITY), item_id, cart_id))
+        if rowcount == 0:
             return jsonify({"error": "Not found"}), 404
         return jsonify({"ok": True})
     except Exception as e:
@@ -426,7 +946,7 @@ def create_order():
     product = data.get('product') or ''
     color = data.get('color') or ''
     size = data.get('size') or ''
-    amount = int(data.get('amount') or 1)
+    amount = parse_quantity(data.get('amount'))
     name = data.get('name') or ''
     phone = data.get('phone') or ''
     gov = data.get('gov') or ''
@@ -436,29 +956,27 @@ def create_order():
     shipping = data.get('shipping') or 0
     # Compute total based on amount when possible
     try:
-        total = float(price) * max(amount, 1) + float(shipping or 0)
-    except Exception:
+        total = float(price) * amount + float(shipping or 0)
+    except (TypeError, ValueError):
         total = data.get('total') or 0
     addition = data.get('addition') or ''
-    date_val = data.get('date') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    date_val = data.get('date') or None
 
     try:
         cur = get_db().cursor()
         cur.execute(
-            '''
-            INSERT INTO customers (product, color, size, amount, name, phone, gov, city, address, price, shipping, total, addition, date)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            ''',
+            INSERT_CUSTOMER_SQL,
             (product, color, size, amount, name, phone, gov, city, address, price, shipping, total, addition, date_val)
         )
         get_db().commit()
+        cache_bump('orders:ver')
         oid = cur.lastrowid
         try:
             msg = (
                 f"New order #{oid}: {product} x{amount} | Total={float(total or 0)} | "
                 f"Name={name} | Phone={phone} | {gov}/{city}"
             )
-            send_discord(msg)
+            notify_discord(msg)
         except Exception:
             pass
         return jsonify({"id": oid}), 201
@@ -469,8 +987,12 @@ def create_order():
 @app.get('/api/orders')
 def list_orders():
     try:
-        rows = get_db().execute('SELECT * FROM customers ORDER BY id DESC').fetchall()
-        return jsonify([dict(r) for r in rows])
+        ver = cache_version('orders:ver')
+        etag = f"orders-{ver}" if ver else None
+        if etag and request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        rows = get_db().execute(SELECT_ORDERS_SQL).fetchall()
+        return with_etag(json_response(json_dumps([dict(zip(ORDER_COLUMNS, r)) for r in rows])), etag)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -479,8 +1001,9 @@ def list_orders():
 def delete_order(oid):
     try:
         cur = get_db().cursor()
-        cur.execute('DELETE FROM customers WHERE id = ?', (oid,))
+        cur.execute(DELETE_CUSTOMER_SQL, (oid,))
         get_db().commit()
+        cache_bump('orders:ver')
         if cur.rowcount == 0:
             return jsonify({"error": "Not found"}), 404
         return jsonify({"ok": True})
@@ -501,11 +1024,14 @@ def checkout_order():
     city = data.get('city') or ''
     address = data.get('address') or ''
     addition = data.get('addition') or ''
-    shipping = data.get('shipping') or 0
-    date_val = data.get('date') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    date_val = data.get('date') or None
 
     if not (name and phone and gov and city and address):
         return jsonify({"error": "Missing required fields"}), 400
+    try:
+        shipping_val = float(data.get('shipping') or 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "shipping must be a number"}), 400
 
     cart_id = request.cookies.get('cart_id')
     if not cart_id:
@@ -513,67 +1039,58 @@ def checkout_order():
 
     try:
         conn = get_db()
-        cur = conn.cursor()
-        # Load cart items with product info
-        items = conn.execute(
-            '''
-            SELECT cart_items.*, products.name AS product_name, products.price AS product_price
-            FROM cart_items
-            JOIN products ON products.id = cart_items.product_id
-            WHERE cart_items.cart_id = ?
-            ORDER BY cart_items.id ASC
-            ''',
-            (cart_id,)
-        ).fetchall()
-
-        if not items:
-            return jsonify({"error": "Cart is empty"}), 400
-
-        created_ids = []
-        for it in items:
-            qty = int(it['quantity'] or 1)
-            unit_price = float(it['product_price'] or 0)
-            line_total = unit_price * max(qty, 1) + float(shipping or 0)
-            cur.execute(
-                '''
-                INSERT INTO customers (product, color, size, amount, name, phone, gov, city, address, price, shipping, total, addition, date)
-                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                ''',
-                (
+        # One write transaction for the whole checkout, taken before the cart
+        # is read so no cart write can land between the SELECT and the DELETE
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Load cart items with product info
+            items = conn.execute(SELECT_CHECKOUT_ITEMS_SQL, (cart_id,)).fetchall()
+
+            if not items:
+                return jsonify({"error": "Cart is empty"}), 400
+
+            # Build insert params and the notification totals in a single pass
+            params = []
+            total_sum = 0.0
+            count = 0
+            for it in items:
+                qty = it['quantity']
+                unit_price = float(it['product_price'])
+                subtotal = unit_price * qty
+                total_sum += subtotal
+                count += qty
+                params.append((
                     it['product_name'],
                     it['color'] or '',
                     it['size'] or '',
-                    max(qty, 1),
+                    qty,
                     name,
                     phone,
                     gov,
                     city,
                     address,
                     unit_price,
-                    float(shipping or 0),
-                    line_total,
+                    shipping_val,
+                    subtotal + shipping_val,
                     addition,
                     date_val,
-                ),
-            )
-            created_ids.append(cur.lastrowid)
+                ))
+            conn.executemany(INSERT_CUSTOMER_SQL, params)
+            # AUTOINCREMENT ids from a single executemany inside one write
+            # transaction are contiguous and end at last_insert_rowid()
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
 
-        # Clear cart
-        cur.execute('DELETE FROM cart_items WHERE cart_id = ?', (cart_id,))
-        conn.commit()
+            # Clear cart
+            conn.execute(DELETE_CART_SQL, (cart_id,))
+
+        cache_bump('orders:ver')
+        created_ids = list(range(last_id - len(params) + 1, last_id + 1))
         try:
-            total_sum = 0.0
-            count = 0
-            for it in items:
-                qty_i = int(it['quantity'] or 1)
-                unit_i = float(it['product_price'] or 0)
-                total_sum += unit_i * max(qty_i, 1)
-                count += max(qty_i, 1)
             msg = (
-                f"New checkout: items={count} | Total={total_sum + float(shipping or 0)} | "
+                f"New checkout: items={count} | Total={total_sum + shipping_val} | "
                 f"Name={name} | Phone={phone} | {gov}/{city}"
             )
-            send_discord(msg)
+            notify_discord(msg)
         except Exception:
             pass
         return jsonify({"ok": True, "created": created_ids})
@@ -581,5 +1098,8 @@ def checkout_order():
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
+    # Local development only; in production run:
+    #   gunicorn -c gunicorn_conf.py server:app
     port = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    debug = os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes')
+    app.run(host='0.0.0.0', port=port, debug=debug, threaded=True)